@@ -1,12 +1,12 @@
 import time
 import logging
-from datetime import datetime
 from collections import deque
 from threading import Thread, Lock, Event
 import signal
+import socket
 import sys
 from pymodbus.client.sync import ModbusTcpClient
-from database import IndustrialDatabaseManager
+from database import IndustrialDatabaseManager, Reading, QUALITY_GOOD
 
 logging.basicConfig(
     level=logging.INFO,
@@ -14,15 +14,25 @@ logging.basicConfig(
 )
 logger = logging.getLogger('DataCollector')
 
+# Modbus caps a single holding-register read at 125 registers
+MAX_REGISTERS_PER_READ = 125
+# Unused registers we're willing to read to avoid splitting a block
+MAX_REGISTER_GAP = 8
+
+# PLC reconnect backoff bounds (seconds), doubled after each failed attempt
+MIN_RECONNECT_DELAY = 1
+MAX_RECONNECT_DELAY = 60
+
 
 class PLCConnection:
     """
     Manages connection to a single PLC device over Modbus/TCP
     """
 
-    def __init__(self, host, port=502, timeout=3):
+    def __init__(self, host, port=502, timeout=3, sensor_map=None):
         """
-        Init the PLC connection params like PLC IP Address, port, timeout
+        Init the PLC connection params like PLC IP Address, port, timeout.
+        A custom sensor_map can be passed for PLCs with a different layout.
         """
         self.host = host
         self.port = port
@@ -31,15 +41,30 @@ class PLCConnection:
         self.connected = False
         self.last_error = None
 
-        # Define the sensor map
-        self.sensor_map = {
+        # Define the sensor map. Readings keep the raw register value; unit
+        # and scale are registered in the DB's sensors table on startup and
+        # applied there (see IndustrialDatabaseManager.register_sensors).
+        # A sensor's scale can't change once it has stored readings.
+        self.sensor_map = sensor_map or {
             'temperature': {'address': 0, 'scale': 100, 'unit': '°C'},
             'pressure': {'address': 1, 'scale': 100, 'unit': 'bar'},
             'flow_rate': {'address': 2, 'scale': 100, 'unit': 'L/min'},
             'vibration': {'address': 3, 'scale': 100, 'unit': 'mm/s'},
-            'motor_speed': {'address': 4, 'scale': 100, 'unit': 'RPM'},
+            'motor_speed': {'address': 4, 'scale': 10, 'unit': 'RPM'},
         }
 
+        # Group sensors into contiguous register blocks so each poll is one
+        # Modbus transaction per block instead of one per sensor. Each sensor
+        # is pre-resolved to (interned id, offset in block) so a poll only
+        # has to fill in the value and timestamp.
+        self.register_blocks = [
+            (start, count, tuple(
+                (sys.intern(sensor), config["address"] - start)
+                for sensor, config in members
+            ))
+            for start, count, members in self._plan_register_blocks(self.sensor_map)
+        ]
+
         logger.info(f"Initialized PLC class to: {host}:{port}")
 
 
@@ -53,6 +78,10 @@ class PLCConnection:
 
             self.client = ModbusTcpClient(self.host, port=self.port, timeout=self.timeout)
             self.connected = self.client.connect()
+
+            # Modbus frames are tiny, so don't let Nagle hold them back waiting for more data
+            if self.connected and self.client.socket is not None:
+                self.client.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             
             if self.connected:
                 logger.info(f"Successfully connected to PLC at {self.host}:{self.port}")
@@ -68,11 +97,40 @@ class PLCConnection:
         return self.connected
 
 
+    @staticmethod
+    def _plan_register_blocks(sensor_map, max_gap=MAX_REGISTER_GAP):
+        """
+        Greedily merge sensor addresses into (start, count, sensors) blocks.
+
+        Addresses are sorted and a new block is started whenever the gap to
+        the previous address exceeds max_gap, or the block would exceed the
+        Modbus limit of 125 registers per read. Reading a few unused registers
+        in a gap is much cheaper than an extra network round-trip.
+        """
+        ordered = sorted(sensor_map.items(), key=lambda item: item[1]["address"])
+        blocks = []
+
+        for sensor, config in ordered:
+            address = config["address"]
+
+            if blocks:
+                start, count, members = blocks[-1]
+                last_address = start + count - 1
+                if address - last_address - 1 <= max_gap and address - start < MAX_REGISTERS_PER_READ:
+                    blocks[-1] = (start, address - start + 1, members)
+                    members.append((sensor, config))
+                    continue
+
+            blocks.append((address, 1, [(sensor, config)]))
+
+        return blocks
+
+
     def read_sensors(self):
         """
         Read all sensor data over established Modbus/TCP connection.
         
-        Returns a list of sensor readings w/ timestamps.
+        Returns a list of Reading tuples w/ timestamps.
         """
 
         # Handle cases where connection was not yet established
@@ -82,37 +140,31 @@ class PLCConnection:
         
         # If connected, init an empty list & current timestamps
         readings = []
-        timestamp = datetime.utcnow()
+        timestamp_ns = time.time_ns()
 
         try:
-            for sensor, config in self.sensor_map.items():
+            for start, count, members in self.register_blocks:
                 result = self.client.read_holding_registers(
-                    config["address"],
-                    1,
+                    start,
+                    count,
                     unit=1
                 )
-                logger.debug(f"Raw data from {sensor}: {result}")
+                # Lazy %-formatting: the response repr is only built if DEBUG is enabled
+                logger.debug("Raw data from registers %d-%d: %s", start, start + count - 1, result)
 
                 if result.isError():
-                    logger.warning(f"Error reading {sensor}: {result}")
+                    logger.warning(f"Error reading registers {start}-{start + count - 1}: {result}")
                     continue
 
-                # Converting scaled values into real ones since Modbus cannot send decimals/floats --> We have to scale to get the real values
-                raw_value = result.registers[0]
-                actual_value = raw_value / config.get("scale")
-
-                reading = {
-                    "sensor_id": sensor,
-                    "value": actual_value,
-                    "timestamp": timestamp,
-                    "quality": "good",              # In production we'd validate the values are within exp. range, etc. to eliminate outliers
-                    "unit": config["unit"]
-                }
-
-                readings.append(reading)
+                registers = result.registers
+                for sensor, offset in members:
+                    # Modbus cannot send decimals/floats, so values arrive scaled. They're stored as-is and
+                    # converted back to real values by the DB (sensor_readings_v).
+                    # In production we'd also validate the values are within exp. range, etc. to eliminate outliers
+                    readings.append(Reading(sensor, timestamp_ns, registers[offset], QUALITY_GOOD))
 
             if readings:
-                logger.debug(f"Read {len(readings)} sensor readings successfully.")
+                logger.debug("Read %d sensor readings successfully.", len(readings))
         
         except Exception as e:
             logger.error(f"Error reading from sensors: {e}")
@@ -137,11 +189,10 @@ class DataBuffer:
     """
 
     def __init__(self, flush_interval=30, max_size=1000):
-        self.buffer = deque()                       # A Deque is a list that can be appended/removed from both ends
         self.flush_interval = flush_interval
         self.max_size = max_size
+        self.buffer = deque(maxlen=max_size)        # Bounded ring: if the DB is down, the oldest readings are evicted first
         self.lock = Lock()
-        self.last_flush = time.time()
 
         logger.info("Initialized DataBuffer")
 
@@ -154,10 +205,14 @@ class DataBuffer:
             return
         
         with self.lock:
+            dropped = max(0, len(self.buffer) + len(readings) - self.max_size)
             self.buffer.extend(readings)
             buffer_size = len(self.buffer)
 
-        logger.debug(f"Added {len(readings)} readings, buffer size: {buffer_size}")
+        if dropped:
+            logger.warning(f"Buffer full, dropped {dropped} oldest readings")
+
+        logger.debug("Added %d readings, buffer size: %d", len(readings), buffer_size)
 
         # Check if flush is needed due to size
         if buffer_size >= self.max_size:
@@ -166,27 +221,45 @@ class DataBuffer:
         
         return False
     
-    def should_flush(self):
-        """Checks if it's time to flush."""
-        return (time.time() - self.last_flush) >= self.flush_interval
-    
     def get_and_clear(self):
-        """Get all buffered data and clear the buffer."""
+        """
+        Get all buffered data and clear the buffer. The full deque is swapped
+        out for an empty one, so the lock is only held for an O(1) rebind.
+        """
         with self.lock:
-            data = list(self.buffer)
-            self.buffer.clear()
-            self.last_flush = time.time()
-            return data
+            data, self.buffer = self.buffer, deque(maxlen=self.max_size)
+        return data
         
 
 class IndustrialDataCollector:
-    def __init__(self, plc_host="plc-simulator", db_config=None):
-       self.plc = PLCConnection(plc_host)
+    def __init__(self, plc_host="plc-simulator", db_config=None, plcs=None):
+       """
+       Collects from a single PLC at plc_host, or from every PLCConnection
+       in plcs. Each PLC is polled on its own thread so a slow or offline
+       device doesn't hold up the others; sensor ids must be unique across
+       PLCs since they key the stored readings.
+       """
+       self.plcs = plcs or [PLCConnection(plc_host)]
+
+       # Shared ids would merge PLCs' readings and can collide on the
+       # (sensor_id, timestamp) key, failing whole batches
+       owners = {}
+       for plc in self.plcs:
+            for sensor in plc.sensor_map:
+                owner = owners.setdefault(sensor, plc)
+                if owner is not plc:
+                    raise ValueError(f"Sensor id {sensor!r} is used by both {owner.host}:{owner.port} "
+                                     f"and {plc.host}:{plc.port}")
+
+       self.poll_threads = []
        self.buffer = DataBuffer()
        self.db = IndustrialDatabaseManager(db_config)
 
-       self.running = Event()
-       self.running.set()
+       # Set on shutdown; waiting on it instead of sleeping lets loops exit immediately
+       self.stop_event = Event()
+       # Set by the poll loop to ask the writer thread for an early flush
+       self.flush_event = Event()
+       self.writer_thread = None
 
        self.stats = {
             'readings_collected': 0,
@@ -195,6 +268,8 @@ class IndustrialDataCollector:
             'database_errors': 0,
             'start_time': time.time()
         }
+       # Counters are bumped from every poll thread and the writer thread
+       self.stats_lock = Lock()
 
     def connect_to_systems(self):
        logger.info("Connecting to industrial systems...")
@@ -205,44 +280,79 @@ class IndustrialDataCollector:
        
        self.db.initialize_database()
 
-       if not self.plc.connect():
-            logger.error("Failed to connect to PLC")
+       # Readings are stored raw, so a sensor map whose scale disagrees with
+       # the DB would misreport every value; don't start collecting then
+       for plc in self.plcs:
+            if not self.db.register_sensors(plc.sensor_map):
+                logger.error(f"Failed to register sensors of PLC at {plc.host}:{plc.port}")
+                return False
+
+       # Offline PLCs are retried by their poll loop; only give up if none are reachable
+       connected = 0
+       for plc in self.plcs:
+            if plc.connect():
+                connected += 1
+            else:
+                logger.error(f"Failed to connect to PLC at {plc.host}:{plc.port}")
+
+       if not connected:
+            logger.error("Failed to connect to any PLC")
             return False
        
-       logger.info("Successfully connected to all systems")
+       logger.info(f"Successfully connected to database and {connected}/{len(self.plcs)} PLCs")
        return True
     
 
-    def data_collection_loop(self):
+    def _count(self, key, n=1):
+        """Thread-safe increment of a stats counter."""
+        with self.stats_lock:
+            self.stats[key] += n
+
+
+    def data_collection_loop(self, plc):
         """
-        Main data collection loop.
+        Main data collection loop for one PLC.
         """
-        logger.info("Starting the data collection loop.")
+        logger.info(f"Starting the data collection loop for {plc.host}:{plc.port}.")
         read_interval = 5
+        reconnect_delay = MIN_RECONNECT_DELAY
+
+        # Reads are scheduled against fixed monotonic deadlines, so the time spent
+        # reading and flushing doesn't accumulate as drift between polls
+        next_read = time.monotonic()
+
+        while not self.stop_event.wait(max(0, next_read - time.monotonic())):
+            next_read += read_interval
+
+            # Skip missed deadlines instead of bursting to catch up
+            now = time.monotonic()
+            if next_read < now:
+                next_read = now + read_interval
 
-        while self.running.is_set():
             try:
                 # Ensuring active connection
-                if not self.plc.connected:
-                    if not self.plc.connect():
-                        self.stats["connection_errors"] += 1
-                        time.sleep(10) # Waiting before retries
+                if not plc.connected:
+                    if not plc.connect():
+                        self._count("connection_errors")
+                        # Back off exponentially so an offline PLC isn't hammered with handshakes
+                        logger.info(f"Retrying {plc.host}:{plc.port} in {reconnect_delay}s")
+                        next_read = time.monotonic() + reconnect_delay
+                        reconnect_delay = min(MAX_RECONNECT_DELAY, reconnect_delay * 2)
                         continue
-                readings = self.plc.read_sensors()
+                    reconnect_delay = MIN_RECONNECT_DELAY
+                readings = plc.read_sensors()
 
                 if readings:
                     force_flush = self.buffer.add_readings(readings)
-                    self.stats["readings_collected"] += len(readings)
-
-                    if force_flush or self.buffer.should_flush():
-                        self.flush_buffer_to_database()
+                    self._count("readings_collected", len(readings))
 
-                time.sleep(read_interval)
+                    # Writes happen on the writer thread so a slow DB never delays polling
+                    if force_flush:
+                        self.flush_event.set()
             
             except Exception as e:
                 logger.error(f"Error in data collection loop: {e}")
-                self.stats['connection_errors'] += 1
-                time.sleep(5)
+                self._count('connection_errors')
 
 
     def flush_buffer_to_database(self):
@@ -254,27 +364,35 @@ class IndustrialDataCollector:
         logger.info(f"Flushing {len(readings)} readings to database")
 
         try:
-            success = self.db.bulk_insert_readings(readings)
+            success = self.db.connected and self.db.bulk_insert_readings(readings)
+
+            # A dropped connection leaves the DB marked disconnected; reconnect
+            # (backing off across flushes) and give the batch one more try
+            if not success and not self.db.connected:
+                logger.warning("Database connection lost, reconnecting.")
+                success = self.db.connect() and self.db.bulk_insert_readings(readings)
             
             if success:
-                self.stats["readings_stored"] += len(readings)
+                self._count("readings_stored", len(readings))
                 logger.info(f"Successfully stored {len(readings)} readings")
             else:
-                self.stats['database_errors'] += 1
+                self._count('database_errors')
                 logger.error(f"Failed to store {len(readings)} readings - data lost!")
 
         except Exception as e:
-            self.stats['database_errors'] += 1
+            self._count('database_errors')
             logger.error(f"Database flush error: {e}")
         
 
     def run(self):
         """Main class entry point for the data collector."""
         
-        # Signal handler for graceful shutdowns
+        # Signal handler for graceful shutdowns. It only wakes the loops - logging,
+        # flush and disconnect all run below, outside the handler, since none of
+        # them are safe to re-enter if the signal lands mid-call.
         def _signal_handler(signum, frame):
-            logger.info(f"Received signal {signum}, initiating shut-down.")
-            self.shutdown()
+            self.stop_event.set()
+            self.flush_event.set()
 
         signal.signal(signal.SIGINT, _signal_handler)
         signal.signal(signal.SIGTERM, _signal_handler)
@@ -290,21 +408,50 @@ class IndustrialDataCollector:
             stats_thread.daemon = True
             stats_thread.start()
 
-            self.data_collection_loop()
+            # DB writes
+            self.writer_thread = Thread(target=self._writer_loop)
+            self.writer_thread.daemon = True
+            self.writer_thread.start()
+
+            # One poll thread per PLC; the main thread just waits for a stop signal
+            for plc in self.plcs:
+                poll_thread = Thread(target=self.data_collection_loop, args=(plc,), name=f"poll-{plc.host}")
+                poll_thread.start()
+                self.poll_threads.append(poll_thread)
+
+            self.stop_event.wait()
+            logger.info("Stop signal received, initiating shut-down.")
 
         except Exception as e:
             logger.error(f"Unexpected error in main loop: {e}")
             return 1
         finally:
+            self.shutdown()
             self.cleanup()
 
 
+    def _writer_loop(self):
+        """
+        Flushes the buffer to the DB every flush_interval, or earlier when
+        the poll loop signals flush_event. The final flush on stop is left
+        to shutdown() so two flushes never run concurrently.
+        """
+        while not self.stop_event.is_set():
+            self.flush_event.wait(timeout=self.buffer.flush_interval)
+            self.flush_event.clear()
+
+            if self.stop_event.is_set():
+                break
+
+            self.flush_buffer_to_database()
+
+
     def cleanup(self):
         """Disconnects and shuts down."""
         logger.info("Cleaning up resources...")
 
-        if self.plc:
-            self.plc.disconnect()
+        for plc in self.plcs:
+            plc.disconnect()
         if self.db:
             self.db.disconnect()
 
@@ -316,7 +463,17 @@ class IndustrialDataCollector:
         Graceful loop shut-down, ensuring no unsaved data is lost.
         """
         logger.info("Starting graceful shut-down...")
-        self.running.clear()
+        self.stop_event.set()
+        self.flush_event.set()
+
+        # Poll threads may still be adding their last readings
+        for poll_thread in self.poll_threads:
+            poll_thread.join()
+
+        # Let an in-flight write finish before draining what's left
+        if self.writer_thread and self.writer_thread.is_alive():
+            self.writer_thread.join()
+
         self.flush_buffer_to_database()
 
         logger.info("Graceful shut-down complete.")
@@ -324,14 +481,16 @@ class IndustrialDataCollector:
 
     def _stats_loop(self):
         """Periodically log statistics about data collection."""
-        while self.running.is_set():
+        while not self.stop_event.is_set():
             try:
-                runtime = time.time() - self.stats['start_time']
-                logger.info(f"Stats - Runtime: {runtime:.1f}s, Collected: {self.stats['readings_collected']}, "
-                           f"Stored: {self.stats['readings_stored']}, "
-                           f"Connection errors: {self.stats['connection_errors']}, "
-                           f"DB errors: {self.stats['database_errors']}")
-                time.sleep(60)  # Log stats every minute
+                with self.stats_lock:
+                    stats = dict(self.stats)
+                runtime = time.time() - stats['start_time']
+                logger.info(f"Stats - Runtime: {runtime:.1f}s, Collected: {stats['readings_collected']}, "
+                           f"Stored: {stats['readings_stored']}, "
+                           f"Connection errors: {stats['connection_errors']}, "
+                           f"DB errors: {stats['database_errors']}")
+                self.stop_event.wait(60)  # Log stats every minute
             except Exception as e:
                 logger.error(f"Error in stats loop: {e}")
                 break
@@ -1,11 +1,49 @@
+import numpy as np
 import psycopg2
-import psycopg2.extras
 from datetime import datetime
+import io
 import logging
+import struct
 import time
+from collections import namedtuple
 
 logger = logging.getLogger("DatabaseManager")
 
+# A single sensor reading. Fields follow the sensor_readings column order,
+# so readings can be written to the COPY stream without repacking.
+# timestamp_ns is epoch nanoseconds (time.time_ns()); it is only converted
+# to the DB's timestamp encoding when the reading is written. value is the
+# raw Modbus register - the per-sensor scale is applied by sensor_readings_v.
+Reading = namedtuple("Reading", "sensor_id timestamp_ns value quality")
+
+# Reading quality codes, stored as a SMALLINT instead of repeating the label
+QUALITY_GOOD = 0
+QUALITY_WARN = 1
+QUALITY_BAD = 2
+QUALITY_LABELS = {QUALITY_GOOD: "good", QUALITY_WARN: "warn", QUALITY_BAD: "bad"}
+
+# COPY streams rows in one go and skips the per-statement parse/plan
+# work that INSERT ... VALUES pays for every page of rows. The binary
+# format also skips text formatting on our side and parsing on the server.
+COPY_READINGS_SQL = """
+COPY sensor_readings (sensor_id, timestamp, value, quality)
+FROM STDIN WITH (FORMAT binary)
+"""
+
+# Binary COPY framing: signature, flags and header-extension length up
+# front, a -1 field count as the trailer
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+PGCOPY_TRAILER = struct.pack("!h", -1)
+
+# Each row is a field count, then (length, value) per column. The row
+# head covers sensor_id up to its bytes, the tail packs the fixed-width
+# timestamp (int8), value (int4) and quality (int2) columns.
+COPY_ROW_HEAD = struct.Struct("!hi")
+COPY_ROW_TAIL = struct.Struct("!iqiiih")
+
+# Binary timestamptz is microseconds since 2000-01-01 UTC
+PG_EPOCH_OFFSET_US = 946684800 * 1000000
+
 class IndustrialDatabaseManager:
     def __init__(self, config=None):
         """
@@ -28,6 +66,8 @@ class IndustrialDatabaseManager:
 
         self.connection = None
         self.connected = False
+        self._cursor = None                     # Reused by every bulk insert
+        self._retry_delay = 2                   # Kept across connect() calls so repeated outages keep backing off
 
         logger.info(f"Database manager initialized for {self.config['host']}")
 
@@ -37,24 +77,33 @@ class IndustrialDatabaseManager:
         Connects to DB w/ retry logic. 
         """
         max_retries = 5
-        retry_delay = 2
+        max_retry_delay = 60
+
+        # Reconnecting after a dropped connection: release the dead one first
+        if self.connection is not None:
+            self.disconnect()
 
         for attempt in range(max_retries):
             try:
                 self.connection = psycopg2.connect(**self.config)
+                self.connection.autocommit = False
 
                 with self.connection.cursor() as cursor:
                     cursor.execute("SELECT 1")
 
+                # Opened once per connection instead of once per flush
+                self._cursor = self.connection.cursor()
+
                 self.connected = True
+                self._retry_delay = 2
                 logger.info(f"Connected to database on attempt {attempt + 1}")
                 return True
             
             except Exception as e:
                 logger.warning(f"Database connection attempt {attempt + 1} failed: {e}")
                 if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    retry_delay *= 2
+                    time.sleep(self._retry_delay)
+                    self._retry_delay = min(max_retry_delay, self._retry_delay * 2)
                 else:
                     logger.error("All connection attempts failed.")
                     self.connected = False
@@ -76,37 +125,39 @@ class IndustrialDatabaseManager:
         
         create_readings_table = """
         CREATE TABLE IF NOT EXISTS sensor_readings (
-            id BIGSERIAL PRIMARY KEY,
             sensor_id VARCHAR(50) NOT NULL,
             timestamp TIMESTAMPTZ NOT NULL,
-            value FLOAT NOT NULL,
-            quality VARCHAR(10) DEFAULT 'good',
-            unit VARCHAR(20),
-            created_at TIMESTAMPTZ DEFAULT NOW()
+            value INTEGER NOT NULL,                 -- Raw uint16 register, see sensor_readings_v
+            quality SMALLINT NOT NULL DEFAULT 0,
+            created_at TIMESTAMPTZ DEFAULT NOW(),
+            PRIMARY KEY (sensor_id, timestamp)
         );
         """
 
-        # Creating indexes for efficient querying
+        # Creating indexes for efficient querying. Per-sensor time lookups
+        # are served by the (sensor_id, timestamp) primary key. Timestamps
+        # only ever grow, so a BRIN index covers time-range scans at a tiny
+        # fraction of a btree's size and insert cost.
         create_indexes = [
             """
-            CREATE INDEX IF NOT EXISTS idx_sensor_readings_sensor_time
-            ON sensor_readings (sensor_id, timestamp DESC);
+            DROP INDEX IF EXISTS idx_sensor_readings_timestamp;
             """,
             """
-            CREATE INDEX IF NOT EXISTS idx_sensor_readings_timestamp
-            ON sensor_readings (timestamp DESC);
+            CREATE INDEX IF NOT EXISTS idx_sensor_readings_timestamp_brin
+            ON sensor_readings USING BRIN (timestamp) WITH (pages_per_range = 32);
             """,
             """
             CREATE INDEX IF NOT EXISTS idx_sensor_readings_quality
-            ON sensor_readings (quality) WHERE quality != 'good';
+            ON sensor_readings (quality) WHERE quality <> 0;
             """
         ]
 
         create_sensors_table = """
         CREATE TABLE IF NOT EXISTS sensors (
-            sensor_id VARCHAR(50) PRIMARY_KEY,
+            sensor_id VARCHAR(50) PRIMARY KEY,
             description TEXT,
             unit VARCHAR(20),
+            scale SMALLINT,                         -- Set once by register_sensors, see sensor_readings_v
             min_value FLOAT,
             max_value FLOAT,
             location VARCHAR(100),
@@ -115,17 +166,36 @@ class IndustrialDatabaseManager:
         );
         """
 
+        # Tables created before the scale was owned by the sensor maps
+        # defaulted it to 1; let register_sensors fill it in instead
+        relax_sensor_scale = """
+        ALTER TABLE sensors ALTER COLUMN scale DROP NOT NULL, ALTER COLUMN scale DROP DEFAULT;
+        """
+
+        # Readings are stored as raw registers; this view scales them back
+        # into engineering units and attaches the sensor unit. LEFT JOIN so
+        # readings of unregistered sensors still show up (unscaled, no unit).
+        create_readings_view = """
+        CREATE OR REPLACE VIEW sensor_readings_v AS
+        SELECT r.sensor_id, r.timestamp, r.value::FLOAT / COALESCE(s.scale, 1) AS value, r.quality, s.unit
+        FROM sensor_readings r
+        LEFT JOIN sensors s USING (sensor_id);
+        """
+
 
         try:
             with self.connection as conn:
                 with conn.cursor() as cursor:
                     cursor.execute(create_readings_table)
                     cursor.execute(create_sensors_table)
+                    cursor.execute(relax_sensor_scale)
+                    cursor.execute(create_readings_view)
                     for query in create_indexes:
                         cursor.execute(query)
                     conn.commit()
                     logger.info("Database tables and indexes created successfully")
                     self._insert_default_sensors()
+                    self._enable_timescale()
 
                     return True
 
@@ -135,6 +205,63 @@ class IndustrialDatabaseManager:
             return False
         
 
+    def _enable_timescale(self):
+        """
+        Converts sensor_readings into a TimescaleDB hypertable chunked
+        by day, so time-ranged queries only touch the relevant chunks,
+        and compresses chunks older than a week. TimescaleDB is
+        optional - without the extension we keep the plain table.
+        """
+
+        create_hypertable = [
+            "CREATE EXTENSION IF NOT EXISTS timescaledb;",
+            """
+            SELECT create_hypertable('sensor_readings', 'timestamp',
+                chunk_time_interval => INTERVAL '1 day',
+                create_default_indexes => FALSE,
+                if_not_exists => TRUE);
+            """
+        ]
+
+        enable_compression = [
+            """
+            ALTER TABLE sensor_readings SET (
+                timescaledb.compress,
+                timescaledb.compress_segmentby = 'sensor_id'
+            );
+            """,
+            """
+            SELECT add_compression_policy('sensor_readings', INTERVAL '7 days',
+                if_not_exists => TRUE);
+            """
+        ]
+
+        try:
+            with self.connection as conn:
+                with conn.cursor() as cursor:
+                    for query in create_hypertable:
+                        cursor.execute(query)
+                    conn.commit()
+                    logger.info("sensor_readings is a TimescaleDB hypertable")
+
+        except psycopg2.Error as e:
+            logger.warning(f"TimescaleDB unavailable, using a plain table. Error: {e}")
+            return False
+
+        try:
+            with self.connection as conn:
+                with conn.cursor() as cursor:
+                    for query in enable_compression:
+                        cursor.execute(query)
+                    conn.commit()
+                    logger.debug("TimescaleDB compression policy set.")
+
+        except psycopg2.Error as e:
+            logger.warning(f"Failed to enable TimescaleDB compression. Error: {e}")
+
+        return True
+
+
     def _insert_default_sensors(self):
         """
         Metadata for simulated sensors. IRL, this actually comes
@@ -143,7 +270,8 @@ class IndustrialDatabaseManager:
         
         # Dummy Data to simulate sensor data rows.
         # Each row comes as a tuple of columns
-        # Measure - Sensor Name - Unit - Min Range - Max Range - Production Line 
+        # Measure - Sensor Name - Unit - Min Range - Max Range - Production Line
+        # (the register scale comes from the PLC sensor maps, see register_sensors)
         sensors_metadata = [
             ('temperature', 'Process Temperature Sensor', '°C', 0.0, 100.0, 'Reactor Tank A'),
             ('pressure', 'System Pressure Gauge', 'bar', 0.0, 15.0, 'Main Pipeline'),
@@ -169,13 +297,55 @@ class IndustrialDatabaseManager:
         except psycopg2.Error as e:
             logger.warning(f"Failed to insert data to a table. Error: {e}")
 
+
+    def register_sensors(self, sensor_map):
+        """
+        Registers every sensor in a PLC's sensor map so sensor_readings_v
+        scales its readings with the same config the collector reads them
+        with. The unit is kept up to date, but a scale is only ever set
+        once: stored readings are raw registers, so changing it would
+        silently rescale the sensor's whole history. A map whose scale
+        differs from the stored one is refused and returns False.
+        """
+        if not self.connected:
+            logger.error("Cannot register sensors due to missing connection.")
+            return False
+
+        upsert_query = """
+        INSERT INTO sensors (sensor_id, unit, scale)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (sensor_id) DO UPDATE
+        SET unit = EXCLUDED.unit, scale = COALESCE(sensors.scale, EXCLUDED.scale), updated_at = NOW()
+        RETURNING scale;
+        """
+
+        try:
+            with self.connection as conn:
+                with conn.cursor() as cursor:
+                    mismatched = []
+                    for sensor, config in sensor_map.items():
+                        cursor.execute(upsert_query, (sensor, config["unit"], config["scale"]))
+                        stored_scale = cursor.fetchone()[0]
+                        if stored_scale != config["scale"]:
+                            logger.error(f"Scale of {sensor} is {stored_scale} in the DB but {config['scale']} "
+                                         f"in the sensor map; refusing to rescale its stored readings.")
+                            mismatched.append(sensor)
+                    conn.commit()
+                    logger.debug(f"Registered {len(sensor_map) - len(mismatched)} sensors.")
+                    return not mismatched
+
+        except psycopg2.Error as e:
+            logger.warning(f"Failed to register sensors. Error: {e}")
+            return False
+
             
     def bulk_insert_readings(self, readings):
         """
         Bulk-inserts all readings accumulated over the 
-        buffer period (30s) into the DB table. Readings
-        come as a list of rows -> row is a tuple of column
-        values.  
+        buffer period (30s) into the DB table via binary
+        COPY. Readings come as Reading tuples, already in
+        column order, and are packed straight into the PG
+        binary row format.
         """
 
         if not readings:
@@ -186,35 +356,41 @@ class IndustrialDatabaseManager:
             logger.error("No connection is established with DB. Insertion failed.")
             return False
         
-        insert_data = []
+        copy_data = io.BytesIO()
+        copy_data.write(PGCOPY_HEADER)
+
+        # Only a handful of distinct sensors, so their encoded row heads are cached
+        row_heads = {}
         for reading in readings:
-            insert_data.append((
-                reading["sensor_id"],
-                reading["timestamp"],
-                reading["value"],
-                reading.get("quality", "good"),
-                reading.get("unit", "")
+            row_head = row_heads.get(reading.sensor_id)
+            if row_head is None:
+                encoded_id = reading.sensor_id.encode()
+                row_head = COPY_ROW_HEAD.pack(4, len(encoded_id)) + encoded_id
+                row_heads[reading.sensor_id] = row_head
+
+            copy_data.write(row_head)
+            copy_data.write(COPY_ROW_TAIL.pack(
+                8, reading.timestamp_ns // 1000 - PG_EPOCH_OFFSET_US,
+                4, reading.value,
+                2, reading.quality
             ))
 
-        insert_sql = """
-        INSERT INTO sensor_readings (sensor_id, timestamp, value, quality, unit)
-        VALUES (%s, %s, %s, %s, %s)
-        """
+        copy_data.write(PGCOPY_TRAILER)
+        copy_data.seek(0)
 
         try:
             with self.connection as conn:
-                with conn.cursor() as cursor:
-                    psycopg2.extras.execute_values(
-                        cursor,
-                        insert_sql,
-                        insert_data,
-                        template=None,
-                        page_size=1000          # Processed in batches of 1000
-                        
-                    )
-                    conn.commit()
-                    logger.debug("Sensor data was inserted to the table.")
-                    return True
+                self._cursor.copy_expert(COPY_READINGS_SQL, copy_data)
+                conn.commit()
+                logger.debug("Sensor data was inserted to the table.")
+                return True
+
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            # The connection, and the persistent cursor with it, is gone;
+            # the caller has to reconnect() before the next insert
+            logger.warning(f"Lost database connection during insert. Error: {e}")
+            self.connected = False
+            return False
 
         except psycopg2.Error as e:
             logger.warning(f"Failed to insert data to a table. Error: {e}")
@@ -237,9 +413,10 @@ class IndustrialDatabaseManager:
             where_cond.append("sensor_id = %s")
             params.append(sensor_id)
 
+        # The view scales raw registers and joins in the unit from sensors
         query = f"""
         SELECT sensor_id, timestamp, value, quality, unit
-        FROM sensor_readings
+        FROM sensor_readings_v
         WHERE {' AND '.join(where_cond)}
         ORDER BY timestamp DESC
         LIMIT %s
@@ -247,27 +424,73 @@ class IndustrialDatabaseManager:
         params.append(limit)
 
         try:
-            with self.connection.cursor() as cursor:
-                cursor.execute(query, params)
-
-                readings = []
-                for row in cursor.fetchall():
-                    readings.append({
-                        "sensor_id": row[0],
-                        "timestamp": row[1],
-                        "value": row[2],
-                        "quality": row[3],
-                        "unit": row[4]
-                    })
-
-                logger.debug(f"Retrieved {len(readings)} readings read.")
-                return readings
+            # Server-side cursor: rows are streamed in itersize batches
+            # instead of the whole result being buffered client-side first
+            with self.connection:
+                with self.connection.cursor(name="recent_readings") as cursor:
+                    cursor.itersize = 2000
+                    cursor.execute(query, params)
+
+                    readings = [
+                        {
+                            "sensor_id": row[0],
+                            "timestamp": row[1],
+                            "value": row[2],
+                            "quality": QUALITY_LABELS.get(row[3], "unknown"),
+                            "unit": row[4]
+                        }
+                        for row in cursor
+                    ]
+
+            logger.debug(f"Retrieved {len(readings)} readings read.")
+            return readings
         
         except psycopg2.Error as e:
             logger.error(f"Failed to pull sensor data due to error: {e}")
             return []
 
 
+    def get_recent_array(self, sensor_id, hours=1):
+        """
+        Retrieves one sensor's recent readings as NumPy arrays for
+        vectorised in-process analysis. Returns a tuple of epoch-ns
+        timestamps (int64) and values (float32), oldest first.
+        """
+        timestamps = np.empty(0, dtype=np.int64)
+        values = np.empty(0, dtype=np.float32)
+
+        if not self.connected:
+            logger.error("No connection is established with DB. Query failed.")
+            return timestamps, values
+
+        query = """
+        SELECT (EXTRACT(EPOCH FROM timestamp) * 1000000)::BIGINT * 1000, value
+        FROM sensor_readings_v
+        WHERE sensor_id = %s AND timestamp > NOW() - INTERVAL '%s hours'
+        ORDER BY timestamp
+        """
+
+        try:
+            # Server-side cursor streams rows straight into the array, so the
+            # result is never held as a list of Python tuples
+            with self.connection:
+                with self.connection.cursor(name="recent_array") as cursor:
+                    cursor.itersize = 10000
+                    cursor.execute(query, (sensor_id, hours))
+                    rows = np.fromiter(cursor, dtype=[("ts", np.int64), ("value", np.float32)])
+
+            # Field views of the record array are strided; copy them out so
+            # callers get dense arrays for vectorised math
+            timestamps = np.ascontiguousarray(rows["ts"])
+            values = np.ascontiguousarray(rows["value"])
+            logger.debug(f"Retrieved {len(values)} readings for {sensor_id} as arrays.")
+            return timestamps, values
+
+        except psycopg2.Error as e:
+            logger.error(f"Failed to pull sensor data due to error: {e}")
+            return timestamps, values
+
+
     def get_sensor_stats(self, hours=24):
         if not self.connected:
             return {}
@@ -280,8 +503,8 @@ class IndustrialDatabaseManager:
             MIN(value) as min_value,
             MAX(value) as max_value,
             STDDEV(value) as std_deviation,
-            COUNT(CASE WHEN quality != 'good' THEN 1 END) as bad_readings
-        FROM sensor_readings
+            COUNT(CASE WHEN quality <> 0 THEN 1 END) as bad_readings
+        FROM sensor_readings_v
         WHERE timestamp > NOW() - INTERVAL '%s hours'
         GROUP BY sensor_id
         ORDER BY sensor_id
@@ -317,6 +540,9 @@ class IndustrialDatabaseManager:
         """
         if self.connection:
             try:
+                if self._cursor:
+                    self._cursor.close()
+                    self._cursor = None
                 self.connection.close()
                 self.connected = False
                 logger.info("Disconnected from database")
@@ -1,10 +1,12 @@
 import time
-import random
 import math
-from pymodbus.server.sync import StartTcpServer
+import array
+import asyncio
+import numpy as np
+from numba import njit
+from pymodbus.server.async_io import StartTcpServer
 from pymodbus.device import ModbusDeviceIdentification
 from pymodbus.datastore import ModbusSequentialDataBlock, ModbusSlaveContext, ModbusServerContext
-import threading
 import logging
 
 
@@ -12,6 +14,70 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - PLC - %(message)s'
 logger = logging.getLogger(__name__)
 
 
+# Seconds between sensor updates
+TICK_SECONDS = 3.0
+
+# Ticks worth of Gaussian noise drawn per RNG call
+NOISE_POOL_TICKS = 4096
+
+# The slow process trend follows sin(t / 300); one full period sampled per tick
+TREND_LUT_SIZE = round(2 * math.pi * 300 / TICK_SECONDS)
+
+
+# The explicit signature compiles the kernel eagerly at import, and cache=True
+# persists the machine code in __pycache__, so after the first import (e.g. at
+# image build) the simulator starts without a JIT compile pause. nogil=True
+# lets the kernel run without the GIL should it be called from a worker thread.
+@njit("void(f4[::1], f8, f4, f4[::1], f4[::1], f4[::1], f4[::1], i4[::1])", cache=True, fastmath=True, nogil=True)
+def _tick(cur, t, trend_factor, noise, mins, maxs, scales, out):
+    """
+    Computes one tick of sensor values. Takes the previous values (cur),
+    seconds since start (t), the slow process trend and pre-drawn Gaussian
+    noise, and writes the values clamped to [mins, maxs] and multiplied by
+    scales into out.
+    """
+    temperature = 45.0 + trend_factor * 20.0 + noise[0]
+    pressure = 5.2 + (cur[0] - 45.0) / 10.0 + trend_factor * 2.0 + noise[1]
+    flow_rate = 150.0 + (cur[1] - 5.0) * 20.0 + trend_factor * 50.0 + noise[2]
+    vibration = 2.0 + cur[4] / 500.0 + abs(trend_factor) * 3.0 + noise[3]
+
+    # Motor runs for 70% of each 2 minute cycle
+    if (t % 120.0) / 120.0 < 0.7:
+        motor_speed = 1800.0 + trend_factor * 200.0 + noise[4]
+    else:
+        motor_speed = 0.0
+
+    values = (temperature, pressure, flow_rate, vibration, motor_speed)
+    for i in range(5):
+        out[i] = int(min(max(values[i], mins[i]), maxs[i]) * scales[i])
+
+
+class UInt16DataBlock(ModbusSequentialDataBlock):
+    """
+    Register block stored as a typed unsigned 16-bit array instead of a
+    list of Python ints. Like a real register, writing a value outside
+    0-65535 fails (OverflowError) rather than being stored and breaking
+    the Modbus response later.
+    """
+
+    def __init__(self, address, count):
+        super().__init__(address, [0] * count)
+        self.values = array.array("H", [0]) * count
+
+    def getValues(self, address, count=1):
+        start = address - self.address
+        return self.values[start:start + count].tolist()
+
+    def setValues(self, address, values):
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        start = address - self.address
+        self.values[start:start + len(values)] = array.array("H", values)
+
+    def reset(self):
+        self.values = array.array("H", [self.default_value]) * len(self.values)
+
+
 class IndustrialPLCSimulator:
     """
     Simulates real-world PLC incl. data collection, logging, connectivity, etc..
@@ -26,26 +92,56 @@ class IndustrialPLCSimulator:
     def __init__(self):
         """
         Utilizes modbus with 16-bit registers (0-65535). We'll scale decimal values
-        to make them readable.
+        to make them readable, each sensor by a factor that keeps its max in range.
         """
         # Defining the sensors & their specs
         self.sensors = {
-            "temperature": {"address": 0, "min": 15.0, "max": 85.0, "unit": "Celsius"},
-            "pressure": {"address": 1, "min": 0.8, "max": 12.5, "unit": "bar"},
-            "flow_rate": {"address": 2, "min": 0.0, "max": 500.0, "unit": "L/min"},
-            "vibration": {"address": 3, "min": 0.1, "max": 15.0, "unit": "mm/s"},
-            "motor_speed": {"address": 4, "min": 0.0, "max": 3600.0, "unit": "RPM"}
+            "temperature": {"address": 0, "min": 15.0, "max": 85.0, "sigma": 1.5, "scale": 100, "unit": "Celsius"},
+            "pressure": {"address": 1, "min": 0.8, "max": 12.5, "sigma": 0.1, "scale": 100, "unit": "bar"},
+            "flow_rate": {"address": 2, "min": 0.0, "max": 500.0, "sigma": 5.0, "scale": 100, "unit": "L/min"},
+            "vibration": {"address": 3, "min": 0.1, "max": 15.0, "sigma": 0.2, "scale": 100, "unit": "mm/s"},
+            "motor_speed": {"address": 4, "min": 0.0, "max": 3600.0, "sigma": 25.0, "scale": 10, "unit": "RPM"}
         }
 
+        # Sensors occupy one contiguous register block (in _tick's order), so
+        # each tick reads and writes them with a single datastore call
+        addresses = [config["address"] for config in self.sensors.values()]
+        if addresses != list(range(len(addresses))):
+            raise ValueError(f"Sensor addresses must be contiguous from 0, got {addresses}")
+        self._base_addr = 0
+        self._n = len(self.sensors)
+
+        # Same specs as parallel arrays indexed by register position, so the
+        # tick and logging paths never walk the dict-of-dicts
+        self._names = tuple(self.sensors)
+        self._units = tuple(config["unit"] for config in self.sensors.values())
+        self._addrs = np.array([config["address"] for config in self.sensors.values()], dtype=np.int32)
+        self._mins = np.array([config["min"] for config in self.sensors.values()], dtype=np.float32)
+        self._maxs = np.array([config["max"] for config in self.sensors.values()], dtype=np.float32)
+        self._sigmas = np.array([config["sigma"] for config in self.sensors.values()], dtype=np.float32)
+        self._scales = np.array([config["scale"] for config in self.sensors.values()], dtype=np.float32)
+        self._index = {name: i for i, name in enumerate(self._names)}
+
+        # Readings log line, built once: "temperature: {:.1f} Celsius | ..."
+        self._log_tmpl = " | ".join(f"{name}: {{:.1f}} {unit}" for name, unit in zip(self._names, self._units))
+
         # Modbus data blocks (registers), i.e. PLC memory areas
-        self.holding_registers = ModbusSequentialDataBlock(0, [0]*100)                          #TODO: Need to better understand the HRs
+        self.holding_registers = UInt16DataBlock(0, 100)                                       #TODO: Need to better understand the HRs
+
+        # Start every sensor at the middle of its range so the first tick has sane inputs
+        initial_values = ((self._mins + self._maxs) / 2 * self._scales).astype(np.int32)
+        self.holding_registers.setValues(self._base_addr, initial_values.tolist())
 
-        # Modbus Context (like a PLC memory map)
+        # Modbus Context (like a PLC memory map). Unused areas are passed as None
+        # explicitly - leaving them out makes pymodbus allocate full default blocks.
+        # zero_mode serves a read of address N from block index N; by default
+        # pymodbus shifts it to N+1 and the collector would read the wrong sensor.
         self.context = ModbusSlaveContext(
             di = None,                      # Dicrete inputs
             co = None,                      # Coils, digital outputs
             hr = self.holding_registers,    # Holding registers for collected data
-            ir = None                       # Input Registers (Read-only sensors)
+            ir = None,                      # Input Registers (Read-only sensors)
+            zero_mode = True
         )
 
         # Wrapping it as a server supporting multiple slave devices
@@ -54,6 +150,15 @@ class IndustrialPLCSimulator:
             single = True
             )
         
+        # Sensor noise is drawn NOISE_POOL_TICKS ticks at a time and consumed a row per tick
+        self._rng = np.random.default_rng()
+        self._noise_pool = np.empty((0, self._n), dtype=np.float32)
+        self._noise_pos = 0
+
+        # Process trend looked up by tick count instead of calling sin() every tick
+        self._trend_lut = (np.sin(np.arange(TREND_LUT_SIZE) * (2 * np.pi / TREND_LUT_SIZE)) * 0.3).astype(np.float32)
+        self._tick_idx = 0
+
         # Time tracking for sensor variations
         self.start_time = time.time()
         self.running = True
@@ -63,95 +168,113 @@ class IndustrialPLCSimulator:
 
     def generate_data(self):
         """
-        Generates realistic sensor time-series data.
+        Generates realistic sensor time-series data. The math runs in the
+        compiled _tick kernel; this only gathers inputs and writes registers.
         """
         current_time = time.time() - self.start_time
         
         # Store current values to avoid circular dependencies
-        current_values = {}
-        for sensor_name, config in self.sensors.items():
-            address = config['address']
-            try:
-                scaled_value = self.holding_registers.getValues(address, 1)[0]
-                current_values[sensor_name] = scaled_value / 100.0
-            except:
-                current_values[sensor_name] = (config['min'] + config['max']) / 2
-        
-        for sensor_name, config in self.sensors.items():
-            trend_factor = math.sin(current_time / 300) * 0.3
-            
-            if sensor_name == 'temperature':
-                base_value = 45 + trend_factor * 20
-                noise = random.gauss(0, 1.5)
-                
-            elif sensor_name == 'pressure':
-                temp_influence = (current_values.get('temperature', 45) - 45) / 10
-                base_value = 5.2 + temp_influence + trend_factor * 2
-                noise = random.gauss(0, 0.1)
-                
-            elif sensor_name == 'flow_rate':
-                pressure_influence = (current_values.get('pressure', 5) - 5) * 20
-                base_value = 150 + pressure_influence + trend_factor * 50
-                noise = random.gauss(0, 5)
-                
-            elif sensor_name == 'vibration':
-                motor_influence = current_values.get('motor_speed', 0) / 500
-                base_value = 2.0 + motor_influence + abs(trend_factor) * 3
-                noise = random.gauss(0, 0.2)
-                
-            elif sensor_name == 'motor_speed':
-                cycle_position = (current_time % 120) / 120
-                if cycle_position < 0.7:
-                    base_value = 1800 + trend_factor * 200
-                else:
-                    base_value = 0
-                noise = random.gauss(0, 25) if base_value > 0 else 0
-            
-            final_value = base_value + noise
-            final_value = max(config['min'], min(config['max'], final_value))
-            
-            scaled_value = int(final_value * 100)
+        raw_values = self.holding_registers.getValues(self._base_addr, self._n)
+        current_values = np.array(raw_values, dtype=np.float32) / self._scales
+
+        noise = self._next_noise()
+        scaled_values = np.empty(self._n, dtype=np.int32)
+        trend_factor = self._trend_lut[self._tick_idx % TREND_LUT_SIZE]
+        self._tick_idx += 1
 
-            # Writing the reading to the PLC holding registers
-            self.holding_registers.setValues(config['address'], [scaled_value])
+        _tick(current_values, current_time, trend_factor, noise, self._mins, self._maxs, self._scales, scaled_values)
+
+        # Writing all readings to the PLC holding registers in one call
+        self.holding_registers.setValues(self._base_addr, scaled_values.tolist())
             
         logger.debug("Updated sensor readings at time %.1f", current_time)
         
 
+    def _next_noise(self):
+        """
+        Returns one tick of per-sensor Gaussian noise, refilling the pool
+        with a single vectorised draw when it runs out.
+        """
+        if self._noise_pos == len(self._noise_pool):
+            self._noise_pool = self._rng.standard_normal((NOISE_POOL_TICKS, self._n), dtype=np.float32) * self._sigmas
+            self._noise_pos = 0
+
+        noise = self._noise_pool[self._noise_pos]
+        self._noise_pos += 1
+        return noise
+
+
     def get_sensor_values(self, sensor_name):
         """
         Retrieves loaded sensor values.
         """
-        if sensor_name in self.sensors:
-            address = self.sensors[sensor_name]["address"]
-            scaled_values = self.holding_registers.getValues(address, 1)[0]
-            return scaled_values / 100.0
+        i = self._index.get(sensor_name)
+        if i is not None:
+            scaled_values = self.holding_registers.getValues(int(self._addrs[i]), 1)[0]
+            return scaled_values / self._scales[i]
         return 0
     
 
-    def update_sensor_continuously(self):
+    def _log_current(self):
         """
-        Simulates sensor values arriving to PLC each 3 sec. IRL, this
-        happens immediately as the sensors receive data.
+        Logs all current sensor values from one batched register read.
         """
-        logger.info("Starting continuous sensor updates every 3 seconds.")
+        raw_values = self.holding_registers.getValues(self._base_addr, self._n)
+        logger.info("Current readings - %s", self._log_tmpl.format(*(np.array(raw_values) / self._scales)))
+    
+
+    async def update_sensor_continuously(self):
+        """
+        Simulates sensor values arriving to PLC each TICK_SECONDS. IRL, this
+        happens immediately as the sensors receive data. Runs as a task on
+        the same event loop as the Modbus server.
+        """
+        logger.info("Starting continuous sensor updates every %.0f seconds.", TICK_SECONDS)
+        loop = asyncio.get_running_loop()
+
+        # Ticks run on fixed monotonic deadlines so the update time doesn't drift the period
+        next_tick = loop.time()
+        tick = 0
 
         while self.running:
             try:
                 self.generate_data()
+                tick += 1
                 
-                if int(time.time()) % 15 == 0:      # Emit log each 15 seconds
-                    values = []
-                    for name, config in self.sensors.items():
-                        value = self.get_sensor_values(name)
-                        values.append(f"{name}: {value:.1f} {config["unit"]}")
-                    logger.info("Current readings - %s", " | ".join(values))
-
-                time.sleep(3)
+                if tick % 5 == 0:      # Emit log each 15 seconds (every 5th tick)
+                    self._log_current()
 
             except Exception as e:
                 logger.error("Error updating sensors: %s", str(e))
 
+            next_tick += TICK_SECONDS
+            delay = next_tick - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                next_tick = loop.time()             # Fell behind, restart the schedule from now
+                await asyncio.sleep(0)              # but still let the server handle requests
+
+
+    async def _serve(self, identity):
+        """
+        Runs the Modbus server and the sensor updates on one event loop.
+        """
+        sensor_task = asyncio.create_task(self.update_sensor_continuously())
+
+        try:
+            server = await StartTcpServer(
+                context=self.server_context,
+                identity=identity,
+                address=("0.0.0.0", 502),
+                allow_reuse_address=True,
+                defer_start=True
+            )
+            await server.serve_forever()
+        finally:
+            self.running = False
+            sensor_task.cancel()
+
 
     def start_server(self):
         """
@@ -168,22 +291,12 @@ class IndustrialPLCSimulator:
         identity.ModelName = "PLC Simulator v1"
         identity.MajorMinorRevision = "1.0"
 
-        # Start the sensor update threads
-        sensor_thread = threading.Thread(target=self.update_sensor_continuously)
-        sensor_thread.daemon = True
-        sensor_thread.start()
-
         logger.info("Starting Modbus TCP server on 0.0.0.0:502")
         logger.info("Sensor addresses: %s", {name: config["address"] for name, config in self.sensors.items()})
 
         try:
-            # Start Modbus Server
-            StartTcpServer(
-                context=self.server_context,
-                identity=identity,
-                address=("0.0.0.0", 502),
-                allow_reuse_address=True
-            )
+            # Start Modbus Server, with sensor updates on the same event loop
+            asyncio.run(self._serve(identity))
         except Exception as e:
             logger.error(f"Failed to start Modbus TCP server due to: {e}")
             self.running = False